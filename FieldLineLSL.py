@@ -13,21 +13,49 @@ __url__ = "https://github.com/jzerfowski/fieldline_lsl"
 __license__ = "GPL-3.0-only"
 __version__ = "0.3.1"
 
+import os
 import time
 from enum import Enum
-from queue import Queue, Empty
-from typing import Union, List
+from typing import Union, List, Set
 import logging
 from threading import Event, Thread
 import importlib.metadata
+import operator
+import itertools
 
+import numpy as np
 import pylsl
 
 from fieldline.fieldline_api.fieldline_service import FieldLineService
 from fieldline.pycore.sensor import ChannelInfo
 
+from spsc_ring import SPSCRing
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+SAMPLING_RATE = 1000  # Nominal sampling rate of the FieldLine chassis in Hz
+QUEUE_DURATION = 10  # Seconds of data buffered between FieldLine callback and streaming thread before dropping samples
+POLL_TIMEOUT = 0.1  # Seconds the streaming thread waits for data before checking whether streaming was stopped
+DROP_WARNING_INTERVAL = 10  # Minimum number of seconds between two warnings about dropped samples
+MAX_CHUNK_SIZE = 50  # Default maximum number of samples pushed to the LSL outlet at once
+MAX_BUFFERED = 30  # Default number of seconds the LSL outlet buffers for each inlet that can't keep up
+DRIFT_SAMPLE_INTERVAL = 1000  # Number of samples between two measurements of the clock drift
+DRIFT_MIN_MEASUREMENTS = 10  # Number of drift measurements needed before the estimate is used
+DRIFT_MAX_SLEW = 1e-5  # Maximum relative change of the timestamp scale per second of data when correcting clock drift
+
+# pylsl>=1.16 accepts one timestamp per sample in push_chunk. Older versions only take the timestamp of the last sample.
+# Falls back to the last sample's timestamp if the version can't be determined (e.g. pylsl without package metadata)
+try:
+    _pylsl_version = tuple(int(part) for part in importlib.metadata.version('pylsl').split('.')[:2])
+    PYLSL_PER_SAMPLE_TIMESTAMPS = _pylsl_version >= (1, 16)
+except (importlib.metadata.PackageNotFoundError, ValueError):
+    PYLSL_PER_SAMPLE_TIMESTAMPS = False
+
 
 class FieldLineDataType(Enum):
     """
@@ -38,6 +66,14 @@ class FieldLineDataType(Enum):
     CLOSED_LOOP = '50'
 
 
+# Lookup of the data type strings, cheaper than the Enum constructor raising a ValueError for unknown types
+_DATA_TYPE_MAP = {data_type.value: data_type for data_type in FieldLineDataType}
+_OPM_DATA_TYPE_VALUES = (FieldLineDataType.OPEN_LOOP.value, FieldLineDataType.CLOSED_LOOP.value)
+
+# Reads both fields of an incoming sample dict in a single call
+_get_timestamp_and_frames = operator.itemgetter('timestamp', 'data_frames')
+
+
 class Unit_T_Factor(Enum):
     """
     Represent common orders of magnitude and their factors relative to SI unit Tesla
@@ -50,6 +86,58 @@ class Unit_T_Factor(Enum):
     fT = 1E15  # femtoTesla
 
 
+if njit is not None:
+    @njit(cache=True)
+    def apply_calibration(raw: np.ndarray, calibration: np.ndarray, out: np.ndarray):
+        """
+        Multiply the raw sample by the calibration values into out. Compiled with numba if it is installed
+        """
+        for i in range(raw.shape[0]):
+            out[i] = raw[i] * calibration[i]
+else:
+    def apply_calibration(raw: np.ndarray, calibration: np.ndarray, out: np.ndarray):
+        """
+        Multiply the raw sample by the calibration values into out. Compiled with numba if it is installed
+        """
+        np.multiply(raw, calibration, out=out)
+
+
+class ClockDriftEstimator:
+    """
+    Online linear regression of local clock times on chassis timestamps (both relative to the first sample)
+    The slope is the duration of one chassis clock tick in seconds of the local clock, which compensates for drift
+    between both clocks. Uses Welford's algorithm to stay numerically stable over long recordings
+    """
+    __slots__ = ('n', '_mean_chassis', '_mean_local', '_var_chassis', '_cov')
+
+    def __init__(self):
+        self.n: int = 0
+        self._mean_chassis: float = 0.0
+        self._mean_local: float = 0.0
+        self._var_chassis: float = 0.0  # Sum of squared deviations of the chassis timestamps
+        self._cov: float = 0.0  # Sum of the products of deviations of chassis and local timestamps
+
+    def add(self, chassis_delta: int, local_delta: float):
+        """
+        Add one pair of chassis ticks and local seconds elapsed since the first sample
+        """
+        self.n += 1
+        d_chassis = chassis_delta - self._mean_chassis
+        self._mean_chassis += d_chassis / self.n
+        self._mean_local += (local_delta - self._mean_local) / self.n
+        self._var_chassis += d_chassis * (chassis_delta - self._mean_chassis)
+        self._cov += d_chassis * (local_delta - self._mean_local)
+
+    @property
+    def scale(self):
+        """
+        Estimated duration of one chassis clock tick in seconds or None if there are not enough measurements yet
+        """
+        if self.n < DRIFT_MIN_MEASUREMENTS or self._var_chassis == 0:
+            return None
+        return self._cov / self._var_chassis
+
+
 class FieldLineLSL(FieldLineService):
     """
     Instance of FieldLineService to enable streaming of data via LSL
@@ -57,7 +145,10 @@ class FieldLineLSL(FieldLineService):
     See the readme for further information
     """
     def __init__(self, ip_list: List[str], stream_name: str = "FieldLineOPM", source_id: str = "FieldLineOPM_sid",
-                 stream_type='MAG', log_heartbeat: int = 60, unit_T: Unit_T_Factor = Unit_T_Factor.fT, prefix: str = "",):
+                 stream_type='MAG', log_heartbeat: int = 60, unit_T: Unit_T_Factor = Unit_T_Factor.fT, prefix: str = "",
+                 correct_clock_drift: bool = False, stream_cpu_affinity: Set[int] = None,
+                 max_chunk_size: int = MAX_CHUNK_SIZE, chunk_size: int = 1, network_chunk_size: int = 0,
+                 max_buffered: int = MAX_BUFFERED):
         """
         Initialize the FieldLineLSL instance
         :param ip_list: List of ip addresses as strings (without ports)
@@ -67,6 +158,18 @@ class FieldLineLSL(FieldLineService):
         :param log_heartbeat: How often a "heartbeat" should be logged to the console, in seconds. Logs nothing if set to 0
         :param unit_T: Unit of the streamed OPM data (default is femtoTesla (fT))
         :param prefix: prefix for use in FieldLineService (not documented in FieldLine API)
+        :param correct_clock_drift: If True, estimate the drift between chassis clock and local clock while streaming
+            and use it to compute the sample timestamps instead of the nominal 25 MHz chassis clock
+        :param stream_cpu_affinity: Set of CPU ids to pin the streaming thread to (Linux only). If given, the thread
+            also requests real-time scheduling (SCHED_FIFO, needs CAP_SYS_NICE) to reduce jitter and queue build-up
+        :param max_chunk_size: Maximum number of queued samples pushed to LSL at once. Bounds the added latency when
+            the streaming thread has fallen behind
+        :param chunk_size: Number of samples to collect before the streaming thread wakes up and pushes them to LSL as
+            one chunk. Larger values reduce the per-sample overhead at the cost of up to chunk_size ms added latency
+        :param network_chunk_size: Number of samples the LSL outlet collects before sending them over the network.
+            0 sends every pushed chunk right away
+        :param max_buffered: Maximum number of seconds the LSL outlet buffers for each connected inlet before the
+            oldest samples are dropped
         """
         super().__init__(ip_list=ip_list, prefix=prefix)
 
@@ -81,9 +184,11 @@ class FieldLineLSL(FieldLineService):
         self.stream_outlet: pylsl.StreamOutlet = None
 
         self._channel_names: list = None  # set in self._build_channel_names()
+        self._channels: list = None  # Cached result of self.get_channels(), set in self._build_channel_names()
+        self._extract_sample = None  # Generated in self._build_channel_names(), writes a sample's data into a buffer
 
         if unit_T not in Unit_T_Factor:
-            logger.warning(f"{unit_T=} is not a known unit. Please provide an instance of {Unit_T_Factor}")
+            logger.warning("unit_T=%r is not a known unit. Please provide an instance of %s", unit_T, Unit_T_Factor)
             self.unit_T: Unit_T_Factor = Unit_T_Factor.T
         else:
             self.unit_T: Unit_T_Factor = unit_T
@@ -91,18 +196,40 @@ class FieldLineLSL(FieldLineService):
 
         # Internal flags and objects for multithreading
         self.done: Event = Event()
-        self.data_queue: Queue = Queue()
+        # Single producer (FieldLine callback), single consumer (streaming). Bounded, drops the oldest samples when full
+        self.max_chunk_size: int = max(1, max_chunk_size)
+        self.chunk_size: int = min(max(1, chunk_size), self.max_chunk_size)
+        self.data_queue: SPSCRing = SPSCRing(capacity=max(2, int(QUEUE_DURATION * SAMPLING_RATE)),
+                                             wakeup_threshold=self.chunk_size)
+        self.network_chunk_size: int = max(0, network_chunk_size)
+        self.max_buffered: int = max(1, max_buffered)
+        self._dropped_count: int = 0  # Samples dropped because the data queue was full (upper bound, see SPSCRing.put)
 
         self.streaming_thread: Thread = None
+        self.stream_cpu_affinity: Set[int] = stream_cpu_affinity
+        self.heartbeat_thread: Thread = None
         self.running: bool = False
+        self.streaming_stopped: Event = Event()  # Wakes up the heartbeat thread when streaming is stopped
 
-        self._calibration_dict: dict = None  # Calibration values of all channels to compute data in correct unit
+        self._calibration_dict: dict = None  # Calibration values by channel name, only kept for introspection
+        self._calibration_array: np.ndarray = None  # Calibration values in stream order, used to calibrate samples
+        self._channel_name_tuple: tuple = None  # Fixed order of channels in the stream, set with calibration
+        self._sample_buf: np.ndarray = None  # Reused for every chunk pushed by the streaming thread
 
         self.log_heartbeat: int = log_heartbeat
         self.t_stream_start: int = None
 
+        # Anchor of the mapping from chassis timestamps to pylsl.local_clock(), see get_timestamp(). Set by the first
+        # dataframe to arrive and only moved by self._slew_timestamp_scale() afterwards
         self.first_lsl_timestamp = None  # Timestamp of pylsl.local_clock() to sync with chassis_timestamps
         self.first_chassis_timestamp = None  # FieldLine chassis system's timestamp of first dataframe to arrive
+        self._ts_scale: float = 1.0 / 25000.0  # Conversion of chassis timestamps to seconds, see get_timestamp()
+
+        self.correct_clock_drift: bool = correct_clock_drift
+        self._clock_drift: ClockDriftEstimator = ClockDriftEstimator()
+        self._drift_origin: tuple = None  # (chassis, local) timestamps the drift measurements are relative to
+        self._drift_scale: float = self._ts_scale  # Latest drift estimate, self._ts_scale is slewed towards it
+        self._samples_received: int = 0
 
     def init_sensors(self, skip_restart: bool = True, skip_zeroing: bool = True, closed_loop_mode: bool = True,
                      adcs: Union[bool, List[int]] = False):
@@ -117,7 +244,7 @@ class FieldLineLSL(FieldLineService):
         """
         connect_to_sensor_dict = self.load_sensors()
 
-        logger.info(f"Initializing sensors {connect_to_sensor_dict}")
+        logger.info("Initializing sensors %s", connect_to_sensor_dict)
         if not skip_restart:
             self.restart_sensors(connect_to_sensor_dict)
 
@@ -137,26 +264,29 @@ class FieldLineLSL(FieldLineService):
         :param adcs:
         :return:
         """
-        chassis_list = [chassis_dict['chassis_id'] for chassis_dict in self.get_chassis_desc_dicts()]
-        start_adc_on_chassis = []
+        # Only the chassis ids are needed, not the full chassis descriptions with their serial numbers and versions
+        chassis_list = sorted(self.data_source.chassis_name_to_id[chassis_name]
+                              for chassis_name in self.data_source.get_chassis_names())
+        chassis_set = frozenset(chassis_list)
 
-        if isinstance(adcs, bool):
-            if adcs:
-                start_adc_on_chassis = chassis_list
-        elif isinstance(adcs, list):
-            start_adc_on_chassis = [chassis_id for chassis_id in adcs if chassis_id in chassis_list]
+        if not adcs:
+            start_adc_on_chassis = []
+        elif isinstance(adcs, bool):
+            start_adc_on_chassis = chassis_list
+        else:
+            start_adc_on_chassis = [chassis_id for chassis_id in adcs if chassis_id in chassis_set]
 
         for chassis_id in start_adc_on_chassis:
-            logger.info(f"Starting ADCs on chassis {chassis_id}")
+            logger.info("Starting ADCs on chassis %s", chassis_id)
             super().start_adc(chassis_id)
 
-        stop_adc_on_chassis = list(set(chassis_list) - set(start_adc_on_chassis))
+        stop_adc_on_chassis = sorted(chassis_set.difference(start_adc_on_chassis))
 
         for chassis_id in stop_adc_on_chassis:
-            logger.info(f"Stopping ADCs on chassis {chassis_id}")
+            logger.info("Stopping ADCs on chassis %s", chassis_id)
             super().stop_adc(chassis_id)
 
-        if start_adc_on_chassis or stop_adc_on_chassis:
+        if chassis_list:
             # starting and stopping adcs seems to be non-blocking
             time.sleep(0.5)
 
@@ -166,68 +296,93 @@ class FieldLineLSL(FieldLineService):
         """
         Initialize the LSL stream
         """
-        logger.info(f"Initializing LSL stream")
+        logger.info("Initializing LSL stream")
         self.build_stream_info()  # Will automatically set self.stream_info
-        self.stream_outlet = pylsl.StreamOutlet(self.stream_info)
+        self.stream_outlet = pylsl.StreamOutlet(self.stream_info, chunk_size=self.network_chunk_size,
+                                                max_buffered=self.max_buffered)
+        # Scratch buffer for the streaming thread, allocated once the channel count is known. It has to stay a writable,
+        # C-contiguous float32 array (matching cf_float32): pylsl then wraps its leading rows with ctypes' from_buffer
+        # without converting the values. Anything else falls back to pylsl's slow per-value conversion
+        self._sample_buf = np.empty((self.max_chunk_size, self.channel_count), dtype=np.float32)
 
     def restart_sensors(self, sensors: dict):
         """
         Dictionary of sensors to restart
         :param sensors: dictionary of {chassis_id: [list of sensor_ids], ...}
         """
-        logger.info(f"Restarting sensors {sensors}")
+        logger.info("Restarting sensors %s", sensors)
         super().restart_sensors(sensors, on_next=self.callback_restarted, on_error=self.callback_error,
                                 on_completed=lambda: self.callback_completed("Restart"))
-        logger.info(f"Waiting for restart to be complete")
+        logger.info("Waiting for restart to be complete")
 
         self.done.wait()
         self.done.clear()
+        self.clear_sensor_info_cache()
 
     def turn_off_sensors(self, sensors: dict):
         """
         Dictionary of sensors to turn off
         :param sensors: dictionary of {chassis_id: [list of sensor_ids], ...}
         """
-        logger.info(f"Turning off sensors {sensors}")
+        logger.info("Turning off sensors %s", sensors)
         super().turn_off_sensors(sensors)
-        logger.info(f"Turned off sensors {sensors}")
+        self.clear_sensor_info_cache()
+        logger.info("Turned off sensors %s", sensors)
 
     def zero_sensors(self, sensors: dict):
         """
         Dictionary of sensors to perform field-zeroing on
         :param sensors: dictionary of {chassis_id: [list of sensor_ids], ...}
         """
-        logger.info(f"Coarse zeroing sensors {sensors}")
+        logger.info("Coarse zeroing sensors %s", sensors)
         self.coarse_zero_sensors(sensors, on_next=self.callback_coarse_zeroed, on_error=self.callback_error,
                                  on_completed=lambda: self.callback_completed("Coarse zeroing"))
-        logger.info(f"Waiting for coarse zeroing to be complete")
+        logger.info("Waiting for coarse zeroing to be complete")
         self.done.wait()
         self.done.clear()
 
-        logger.info(f"Fine zeroing sensors {sensors}")
+        logger.info("Fine zeroing sensors %s", sensors)
         self.fine_zero_sensors(sensors, on_next=self.callback_fine_zeroed, on_error=self.callback_error,
                                on_completed=lambda: self.callback_completed("Fine zeroing"))
         logger.info("Waiting for fine zeroing to be complete")
         self.done.wait()
         self.done.clear()
+        self.clear_sensor_info_cache()
 
     def start_streaming(self):
         """
         Start the LSL streaming. Non-blocking!
         :return:
         """
+        if self.running:
+            # Registering the data callback again would restart the chassis' data stream and a second streaming
+            # thread would compete for the data queue
+            logger.warning("Streaming already running. Nothing to start.")
+            return
+
         if self.stream_outlet is None:
             self.init_stream()
 
-        logger.info(f"Starting to read data from chassis")
+        # Drift measurements of an earlier run are not continued, the last estimate is kept until there is a new one
+        self._clock_drift = ClockDriftEstimator()
+        self._drift_origin = None
+        self._samples_received = 0
+
+        logger.info("Starting to read data from chassis")
         self.read_data(self.callback_data_available)
 
-        logger.info(f"Starting streaming Thread")
+        logger.info("Starting streaming Thread")
         self.running = True
         self.streaming_thread = Thread(target=self.thread_stream_data,
                                        name=f"FieldLine LSL Streaming ({self.stream_name})")
         self.streaming_thread.start()
 
+        if self.log_heartbeat:
+            self.streaming_stopped.clear()
+            self.heartbeat_thread = Thread(target=self.thread_heartbeat,
+                                           name=f"FieldLine LSL Heartbeat ({self.stream_name})", daemon=True)
+            self.heartbeat_thread.start()
+
     def stop_streaming(self):
         """
         Stop the LSL streaming. Blocks until streaming is stopped
@@ -235,11 +390,22 @@ class FieldLineLSL(FieldLineService):
         """
         if self.running:
             self.running = False
+            self.streaming_stopped.set()
             self.read_data(data_callback=None)
             self.streaming_thread.join()
-            logger.info(f"Stopped streaming")
+            # Push the samples the streaming thread did not get to before it stopped
+            batch = self.data_queue.drain(self.max_chunk_size)
+            while batch:
+                self._push_batch(batch)
+                batch = self.data_queue.drain(self.max_chunk_size)
+            # Nothing queued may survive until the next start_streaming, it would be pushed with outdated timestamps
+            self.data_queue.clear()
+            if self.heartbeat_thread is not None:
+                self.heartbeat_thread.join()
+                self.heartbeat_thread = None
+            logger.info("Stopped streaming")
         else:
-            logger.warning(f"Streaming not running. Nothing to stop.")
+            logger.warning("Streaming not running. Nothing to stop.")
 
     def close(self):
         """
@@ -250,6 +416,8 @@ class FieldLineLSL(FieldLineService):
             self.stop_streaming()
         self.stream_info = None
         self.stream_outlet = None
+        self._sample_buf = None
+        self.clear_sensor_info_cache()
         super().close()
 
     def thread_stream_data(self):
@@ -257,42 +425,119 @@ class FieldLineLSL(FieldLineService):
         Stream the incoming data on the LSL stream until self.running is set to False
         :return:
         """
+        if self.stream_cpu_affinity:
+            self._set_streaming_thread_scheduling()
+
         self.t_stream_start = pylsl.local_clock()
-        next_heartbeat = self.t_stream_start
-        logger.info(f"Starting to stream data on {self.stream_name} at t_local={self.t_stream_start}")
+        logger.info("Starting to stream data on %s at t_local=%s", self.stream_name, self.t_stream_start)
+
+        # Bind everything needed per sample to locals, they are resolved faster than attributes and globals in the loop.
+        # Only self.running is read from the instance because it signals the end of streaming
+        push_batch = self._push_batch
+        channel_count = self.channel_count
+        q_get = self.data_queue.get
+        q_drain = self.data_queue.drain
+        max_batch = self.max_chunk_size
+
+        missed_polls = 0  # Number of consecutive polls without data
+        dropped_reported = self._dropped_count  # Samples are dropped by the producer, reported here rate-limited
+        t_drop_warning = 0.0
+        polls_per_warning = max(1, round(1 / POLL_TIMEOUT))  # Warn about missing data about once per second
+
+        # Every chunk row is filled from the channel names, so the pushed chunks always match the stream's channel count
+        if len(self._channel_name_tuple) != channel_count:
+            raise RuntimeError(f"Number of channel names ({len(self._channel_name_tuple)}) does not match the stream's "
+                               f"channel count ({channel_count})")
 
         while self.running:
-            now = pylsl.local_clock()
-
-            if self.log_heartbeat and now >= next_heartbeat:
-                next_heartbeat += self.log_heartbeat
-                logger.info(
-                    f"Streaming data on {self.stream_name} since {now - self.t_stream_start:.1f} seconds (t_local={now})")
-            try:
-                data = self.data_queue.get(block=True, timeout=1)
-            except Empty as e:
-                logger.warning(
-                    f"No data was received in time by streaming Thread after {now - self.t_stream_start:.1f} (t_local={now})")
+            data = q_get(timeout=POLL_TIMEOUT)
+            if data is None:
+                # Short hiccups of the producer are not worth a warning, only report actual inactivity
+                missed_polls += 1
+                if missed_polls % polls_per_warning == 0:
+                    logger.warning("No data was received in time by streaming Thread for %.1f seconds",
+                                   missed_polls * POLL_TIMEOUT)
                 continue
-
-            sample_timestamp = data['timestamp']  # We don't use this because LSL generates its own timestamps
-            data_frames = data['data_frames']
-            sample = [data_frames[channel_name]['data'] * self._calibration_dict[channel_name] for channel_name in
-                      self.channel_names]
-
-            try:
-                timestamp = self.get_timestamp(sample_timestamp)
-                self.stream_outlet.push_sample(sample, timestamp)
-            except ValueError as e:
-                logger.warning(f"Incoming sample had wrong dimensions:\n{e}")
-                # Simply continue after an error because proper stream might come back
+            missed_polls = 0
+            if self._dropped_count != dropped_reported:
+                now = pylsl.local_clock()
+                if now - t_drop_warning >= DROP_WARNING_INTERVAL:
+                    dropped = self._dropped_count
+                    logger.warning("%d samples were dropped since the last report because the data queue was full",
+                                   dropped - dropped_reported)
+                    dropped_reported = dropped
+                    t_drop_warning = now
+
+            # Collect everything that has queued up in the meantime to push it as one chunk
+            batch = [data]
+            batch += q_drain(max_batch - 1)
+            push_batch(batch)
 
         stream_stop = pylsl.local_clock()
+        if self._dropped_count != dropped_reported:
+            logger.warning("%d samples were dropped since the last report because the data queue was full",
+                           self._dropped_count - dropped_reported)
 
-        logger.info(f"Stopping to stream on {self.stream_name} after {stream_stop - self.t_stream_start} seconds"
-                    f" at t_local={stream_stop}")
+        logger.info("Stopping to stream on %s after %s seconds at t_local=%s", self.stream_name,
+                    stream_stop - self.t_stream_start, stream_stop)
         self.t_stream_start = None
 
+    def _push_batch(self, batch: list):
+        """
+        Push queued samples to the LSL outlet as one chunk. Must only be called from the streaming thread or after it
+        was joined
+        :param batch: List of (chassis timestamp, calibrated row) tuples from the data queue, at most max_chunk_size
+            long
+        """
+        chunk = self._sample_buf[:len(batch)]  # Contiguous view, no allocation
+        np.stack([row for _, row in batch], out=chunk)  # Rows are calibrated already
+
+        if self.correct_clock_drift and self._drift_scale != self._ts_scale:
+            self._slew_timestamp_scale(batch[0][0])
+
+        if PYLSL_PER_SAMPLE_TIMESTAMPS and len(batch) > 1:
+            # Keeps the true acquisition times even if the chassis skipped samples within this chunk
+            timestamps = self.get_timestamps([chassis_timestamp for chassis_timestamp, _ in batch])
+            self.stream_outlet.push_chunk(chunk, timestamps)
+        else:
+            # LSL assigns the timestamp to the most recent sample and deduces the others from the sampling rate
+            chassis_timestamp, _ = batch[-1]
+            self.stream_outlet.push_chunk(chunk, self.get_timestamp(chassis_timestamp))
+
+    def _set_streaming_thread_scheduling(self):
+        """
+        Pin the calling (streaming) thread to self.stream_cpu_affinity and try to raise it to real-time priority.
+        Failures are only logged because streaming works without, just with more jitter
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            logger.warning("Setting the CPU affinity of the streaming thread is not supported on this platform")
+            return
+
+        try:
+            os.sched_setaffinity(0, self.stream_cpu_affinity)  # 0 is the calling thread on Linux
+            logger.info("Pinned streaming thread to CPUs %s", self.stream_cpu_affinity)
+        except OSError as e:
+            logger.warning("Could not pin streaming thread to CPUs %s: %s", self.stream_cpu_affinity, e)
+
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+            logger.info("Streaming thread runs with real-time priority")
+        except OSError as e:
+            logger.warning("Could not set real-time priority of the streaming thread (requires CAP_SYS_NICE): %s", e)
+
+    def thread_heartbeat(self):
+        """
+        Log a heartbeat every self.log_heartbeat seconds until streaming is stopped. Runs in its own thread so the
+        streaming loop does not have to check the clock for every sample
+        :return:
+        """
+        t_start = pylsl.local_clock()
+        logger.info("Streaming data on %s (t_local=%s)", self.stream_name, t_start)
+
+        while not self.streaming_stopped.wait(self.log_heartbeat):
+            now = pylsl.local_clock()
+            logger.info("Streaming data on %s since %.1f seconds (t_local=%s)", self.stream_name, now - t_start, now)
+
     def _set_calibration_dict(self):
         calibration_dict = dict()
         for channel in self.get_channels():
@@ -303,17 +548,32 @@ class FieldLineLSL(FieldLineService):
             calibration_dict[channel.name] = calibration_value
         self._calibration_dict = calibration_dict
 
+        # Calibration values as array in stream order so a sample can be calibrated with a single multiplication
+        # instead of looking up every channel name
+        self._calibration_array = np.fromiter((calibration_dict[name] for name in self._channel_names),
+                                              dtype=np.float32, count=len(self._channel_names))
+        self._channel_name_tuple = tuple(self._channel_names)
+
+        # Calling the calibration once with arrays of the real types compiles it here (if numba is installed) instead
+        # of blocking the FieldLine data callback on the first sample
+        warmup_row = np.zeros_like(self._calibration_array)
+        apply_calibration(warmup_row, self._calibration_array, warmup_row)
+
     def build_stream_info(self):
         """
         Obtain the information needed to open an lsl stream and write a
         StreamInfo object immediately into self.stream_info.
         """
-        # Obtain the information we need to open an LSL stream:
+        # Obtain the information we need to open an LSL stream before touching the StreamInfo, so the channels are only
+        # traversed once and the metadata is written in a single pass below
+        channels = self.get_channels()
+        chassis_dicts = self.get_chassis_desc_dicts()
+        channel_dicts = self.get_channel_desc_dicts(channels)
 
-        self.channel_count = len(self.get_channels())
+        self.channel_count = len(channels)
 
         self.stream_info = pylsl.StreamInfo(self.stream_name, type=self.stream_type, channel_count=self.channel_count,
-                                            nominal_srate=1000, channel_format=pylsl.cf_float32,
+                                            nominal_srate=SAMPLING_RATE, channel_format=pylsl.cf_float32,
                                             source_id=self.source_id)
 
         desc = self.stream_info.desc()
@@ -321,16 +581,16 @@ class FieldLineLSL(FieldLineService):
         desc.append_child_value('fieldline_api-version', importlib.metadata.version('fieldline_api'))
 
         desc_chassis_all = desc.append_child("chassis")
-        for chassis_dict in self.get_chassis_desc_dicts():
+        for chassis_dict in chassis_dicts:
             desc_chassis_id = desc_chassis_all.append_child("chassis")
             for key, value in chassis_dict.items():
-                desc_chassis_id.append_child_value(key, str(value))
+                desc_chassis_id.append_child_value(key, value if isinstance(value, str) else str(value))
 
         desc_channels = desc.append_child("channels")
-        for channel_dict in self.get_channel_desc_dicts():
+        for channel_dict in channel_dicts:
             desc_channel = desc_channels.append_child('channel')
             for key, value in channel_dict.items():
-                desc_channel.append_child_value(key, str(value))
+                desc_channel.append_child_value(key, value if isinstance(value, str) else str(value))
 
     def get_chassis_desc_dicts(self):
         """
@@ -355,6 +615,12 @@ class FieldLineLSL(FieldLineService):
             version=self.get_version(chassis_id)
         )
 
+    def clear_sensor_info_cache(self):
+        """
+        Forget the cached list of channels, which may change when sensors are restarted, zeroed or turned off
+        """
+        self._channels = None
+
     def get_channel_desc_dict(self, channel: ChannelInfo):
         """
         Return a  dictionary containing name (label), data type, calibration values and more of a sensor.
@@ -370,16 +636,17 @@ class FieldLineLSL(FieldLineService):
                             calibration=channel.calibration,
                             )
 
-        if self.get_data_type(channel) == FieldLineDataType.ADC:
+        data_type = self.get_data_type(channel)
+        if data_type == FieldLineDataType.ADC:
             channel_dict.update(type='misc', unit="V", mode="ADC")
-        elif self.get_data_type(channel) == FieldLineDataType.CLOSED_LOOP:
+        elif data_type == FieldLineDataType.CLOSED_LOOP:
             channel_dict.update(type='mag', unit=self.unit_T.name, mode="Closed Loop")
-        elif self.get_data_type(channel) == FieldLineDataType.OPEN_LOOP:
+        elif data_type == FieldLineDataType.OPEN_LOOP:
             channel_dict.update(type='mag', unit=self.unit_T.name, mode="Open Loop")
         else:
             channel_dict.update(type='misc', unit="?", mode="Unknown")
 
-        if self.is_OPM_type(channel):
+        if self.is_OPM_data_type(data_type):
             serial_card, serial_sensor = self.get_serial_numbers(chassis_id, sensor_id)
             field_X, field_Y, field_Z = self.get_fields(chassis_id, sensor_id)
 
@@ -397,63 +664,145 @@ class FieldLineLSL(FieldLineService):
         :param channel:
         :return:
         """
-        try:
-            return FieldLineDataType(channel.data_type)
-        except ValueError:
-            return None
+        return _DATA_TYPE_MAP.get(channel.data_type)
 
     def is_OPM_type(self, channel):
-        return self.get_data_type(channel) in [FieldLineDataType.CLOSED_LOOP, FieldLineDataType.OPEN_LOOP]
+        return channel.data_type in _OPM_DATA_TYPE_VALUES
+
+    @staticmethod
+    def is_OPM_data_type(data_type: FieldLineDataType):
+        return data_type in (FieldLineDataType.CLOSED_LOOP, FieldLineDataType.OPEN_LOOP)
 
-    def get_channel_desc_dicts(self):
-        return [self.get_channel_desc_dict(channel) for channel in self.get_channels()]
+    def get_channel_desc_dicts(self, channels: List[ChannelInfo] = None):
+        if channels is None:
+            channels = self.get_channels()
+        return [self.get_channel_desc_dict(channel) for channel in channels]
 
     def callback_restarted(self, chassis_id, sensor_id):
-        logger.debug(f"Sensor {chassis_id:02}:{sensor_id:02} restarted")
+        logger.debug("Sensor %02d:%02d restarted", chassis_id, sensor_id)
 
     def callback_coarse_zeroed(self, chassis_id, sensor_id):
-        logger.debug(f"Sensor {chassis_id:02}:{sensor_id:02} coarse-zeroed")
+        logger.debug("Sensor %02d:%02d coarse-zeroed", chassis_id, sensor_id)
 
     def callback_fine_zeroed(self, chassis_id, sensor_id):
-        logger.debug(f"Sensor {chassis_id:02}:{sensor_id:02} fine-zeroed")
+        logger.debug("Sensor %02d:%02d fine-zeroed", chassis_id, sensor_id)
 
     def callback_error(self, chassis_id, sensor_id, err):
-        logger.warning(f"Sensor {chassis_id:02}:{sensor_id:02} failed with {hex(err)}")
+        logger.warning("Sensor %02d:%02d failed with %#x", chassis_id, sensor_id, err)
 
     def callback_completed(self, initialization_step_name: str):
-        logger.info(f"{initialization_step_name} completed")
+        logger.info("%s completed", initialization_step_name)
         self.done.set()
 
     def callback_data_available(self, data):
+        chassis_timestamp, data_frames = _get_timestamp_and_frames(data)
         if self.first_lsl_timestamp is None:
             # If this is the first sample, save the chassis system timestamp and this device's reference time
             # this is used in self.get_timestamp()
             self.first_lsl_timestamp = pylsl.local_clock()
-            self.first_chassis_timestamp = data['timestamp']
-
-        self.data_queue.put(data)
+            self.first_chassis_timestamp = chassis_timestamp
+
+        self._samples_received += 1
+        if self.correct_clock_drift and self._samples_received % DRIFT_SAMPLE_INTERVAL == 0:
+            self._measure_clock_drift(chassis_timestamp)
+
+        # Extract and calibrate the sample in one go, so only a calibrated row in stream order is handed to the
+        # streaming thread instead of the nested dictionaries
+        row = np.empty(self.channel_count, dtype=np.float32)
+        self._extract_sample(data_frames, row)
+        apply_calibration(row, self._calibration_array, row)
+
+        if self.data_queue.put((chassis_timestamp, row)):
+            # Dropping the oldest sample keeps memory and latency bounded if the streaming thread can't keep up
+            self._dropped_count += 1
+
+    def _measure_clock_drift(self, chassis_timestamp):
+        """
+        Pair the chassis timestamp of the sample that just arrived with the local clock and update the drift estimate.
+        Called from the FieldLine data callback, the estimate is only applied by the streaming thread
+        """
+        local_timestamp = pylsl.local_clock()
+        if self._drift_origin is None:
+            self._drift_origin = (chassis_timestamp, local_timestamp)
+            return
+        origin_chassis, origin_local = self._drift_origin
+        self._clock_drift.add(chassis_timestamp - origin_chassis, local_timestamp - origin_local)
+        scale = self._clock_drift.scale
+        if scale is not None:
+            self._drift_scale = scale
+
+    def _slew_timestamp_scale(self, chassis_timestamp):
+        """
+        Move the scale used by get_timestamp() towards the estimated drift, by at most DRIFT_MAX_SLEW per second of data
+        since the last change. The mapping is re-anchored at chassis_timestamp, so the timestamps stay continuous and
+        monotonic instead of jumping whenever the estimate changes. Must only be called from the streaming thread with
+        the oldest chassis timestamp that was not pushed yet
+        """
+        scale = self._ts_scale
+        max_step = scale * DRIFT_MAX_SLEW * (chassis_timestamp - self.first_chassis_timestamp) * scale
+        if max_step <= 0:
+            return
+        self.first_lsl_timestamp = self.get_timestamp(chassis_timestamp)
+        self.first_chassis_timestamp = chassis_timestamp
+        self._ts_scale = min(max(self._drift_scale, scale - max_step), scale + max_step)
 
     def get_timestamp(self, chassis_timestamp):
         """
         Transform a chassis system timestamp into an pylsl.local_clock() timestamp
-        Uses 25000 because the clock on FieldLine chassis is 25 MHz and sfreq is 1 kHz.
+        Uses 25000 because the clock on FieldLine chassis is 25 MHz and sfreq is 1 kHz (or the estimated drift if
+        correct_clock_drift is set). The difference to the first chassis timestamp is computed on the integer
+        timestamps and only converted to seconds in the end so no precision is lost on long recordings
         :param chassis_timestamp:
         :return:
         """
-        return self.first_lsl_timestamp + (chassis_timestamp - self.first_chassis_timestamp) / 25000.0
+        return self.first_lsl_timestamp + (chassis_timestamp - self.first_chassis_timestamp) * self._ts_scale
+
+    def get_timestamps(self, chassis_timestamps: List[int]):
+        """
+        Vectorized version of get_timestamp() for a list of chassis system timestamps
+        :param chassis_timestamps: List of chassis system timestamps
+        :return: List of pylsl.local_clock() timestamps
+        """
+        chassis_deltas = np.fromiter(chassis_timestamps, dtype=np.int64, count=len(chassis_timestamps))
+        chassis_deltas -= self.first_chassis_timestamp
+        return (self.first_lsl_timestamp + chassis_deltas * self._ts_scale).tolist()
 
     def get_sensors(self):
         return self.data_source.get_sensors()
 
     def get_channels(self):
-        return [channel for sensor in self.get_sensors() for channel in sensor.get_channels()]
+        """
+        Return the channels of all sensors. Cached after the channel names were built in init_sensors() until sensors are
+        restarted, zeroed, turned off or the service is closed
+        """
+        if self._channels is not None:
+            return self._channels
+        return list(itertools.chain.from_iterable(sensor.get_channels() for sensor in self.get_sensors()))
 
     def _build_channel_names(self):
         """
         Sets self._channel_names to have a fixed list of channels
         :return:
         """
-        self._channel_names = [channel.name for channel in self.get_channels()]
+        self._channels = None
+        self._channels = self.get_channels()
+        self._channel_names = [channel.name for channel in self._channels]
+        self._extract_sample = self._generate_sample_extractor(self._channel_names)
+
+    @staticmethod
+    def _generate_sample_extractor(channel_names: List[str]):
+        """
+        Generate a function extract(data_frames, buffer) that writes the data of all channels into buffer in the order of
+        channel_names. The channel names are spelled out in the generated code, so no loop over the channels is left
+        when extracting a sample
+        :param channel_names: Fixed list of channel names in stream order
+        :return: The generated function
+        """
+        frame_values = "".join(f"data_frames[{name!r}]['data'], " for name in channel_names)
+        source = f"def extract(data_frames, buffer):\n    buffer[:] = ({frame_values})\n"
+        namespace = dict()
+        exec(compile(source, "<FieldLineLSL sample extractor>", "exec"), namespace)
+        return namespace['extract']
 
     @property
     def channel_names(self):
@@ -0,0 +1,90 @@
+"""
+Single-producer/single-consumer ring buffer
+Used by FieldLineLSL to hand incoming data from the FieldLine callback thread to the LSL streaming thread without
+taking a lock for every sample.
+"""
+
+from collections import deque
+from threading import Event
+
+
+class SPSCRing:
+    """
+    Fixed-capacity ring buffer for exactly one producer thread and one consumer thread.
+    Backed by a collections.deque with maxlen, whose append() and popleft() are atomic in CPython, so the handoff
+    itself needs no lock and a full ring drops its oldest item without any coordination with the consumer.
+    An Event is only waited on when the consumer finds fewer than wakeup_threshold items and only set by the producer
+    when the ring fills up to that threshold, so the consumer can be woken once per batch instead of once per item.
+    Unlike queue.Queue, get() returns None on timeout so the consumer does not need an exception handler around every
+    call
+    """
+    __slots__ = ('_items', '_wakeup_threshold', '_available')
+
+    def __init__(self, capacity: int = 16384, wakeup_threshold: int = 1):
+        """
+        Initialize the ring buffer
+        :param capacity: Maximum number of items held at once
+        :param wakeup_threshold: Number of items that have to be available before a waiting get() returns early
+        """
+        self._items: deque = deque(maxlen=max(1, capacity))
+        self._wakeup_threshold: int = min(max(1, wakeup_threshold), self._items.maxlen)
+        self._available: Event = Event()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def capacity(self):
+        return self._items.maxlen
+
+    def put(self, item):
+        """
+        Append an item to the ring, dropping the oldest item if the ring is full. Must only be called from the producer
+        thread
+        :return: True if the oldest item was dropped to make room. Approximate: if the consumer pops an item between
+            the check and the append, True is returned although nothing was dropped. This can only happen while the
+            ring is full, so counts of dropped items are upper bounds that are only off while the ring is overflowing
+        """
+        items = self._items
+        # The deque drops silently, so whether it will has to be checked before appending. Comparing the length before
+        # and after the append would not be exact either because the consumer may pop in between
+        dropped = len(items) == items.maxlen
+        items.append(item)
+        if len(items) == self._wakeup_threshold:
+            # The ring just reached the threshold, so the consumer may be waiting for it. Checked after appending the
+            # item because the consumer checks again after clearing the flag, so no wakeup can get lost in between
+            self._available.set()
+        return dropped
+
+    def drain(self, max_items: int):
+        """
+        Remove and return up to max_items of the oldest items at once. Must only be called from the consumer thread
+        :return: List of items, empty if the ring is empty
+        """
+        # The producer can never shrink the ring (a full ring stays full), so at least this many items can be popped
+        popleft = self._items.popleft
+        return [popleft() for _ in range(min(len(self._items), max_items))]
+
+    def clear(self):
+        """
+        Remove all items. Must only be called from the consumer thread or while the producer is stopped
+        """
+        self._items.clear()
+        self._available.clear()
+
+    def get(self, timeout: float = None):
+        """
+        Remove and return the oldest item. Waits until wakeup_threshold items are available or the timeout expired
+        :param timeout: Maximum time to wait in seconds. Waits indefinitely if None
+        :return: The oldest item or None if the ring is still empty after the timeout (None can therefore not be put as
+            an item)
+        """
+        items = self._items
+        if len(items) < self._wakeup_threshold:
+            # Only clear the flag below the threshold and check again to not miss an item put in the meantime
+            self._available.clear()
+            if len(items) < self._wakeup_threshold:
+                self._available.wait(timeout)
+            if not items:
+                return None
+        return items.popleft()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
 """Start a LabStreamingLayer Stream from FieldLine Optically Pumped Magnetometers"""
+import os
 import time
 import argparse
+import atexit
+import configparser
 import logging
 import sys
+import tempfile
 
 import FieldLineLSL
 
@@ -37,6 +41,74 @@ def set_verbosity(logging_config, logger, verbosity):
 logger = logging.getLogger(__name__)
 
 
+# Configuration files liblsl reads if LSLAPICFG is not set, in order of precedence
+LSL_API_CONFIG_PATHS = ['lsl_api.cfg', os.path.expanduser(os.path.join('~', 'lsl_api', 'lsl_api.cfg')),
+                        os.path.join(os.sep, 'etc', 'lsl_api', 'lsl_api.cfg')]
+
+
+def positive_int(value):
+    """
+    argparse type for integers greater than 0
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def non_negative_int(value):
+    """
+    argparse type for integers greater than or equal to 0
+    """
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+    return number
+
+
+def remove_file(path):
+    """
+    Remove a file if it still exists
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_lsl_api_config(send_buffer_kb):
+    """
+    Write an LSL configuration file with the given socket send buffer size and point liblsl to it. All other settings
+    are copied from the configuration liblsl would have used otherwise. Has to be called before the first LSL stream is
+    created because liblsl reads its configuration only once. The file is removed when the program exits
+    :param send_buffer_kb: Size of the socket send buffer of the LSL outlet in kilobytes
+    :return: Path of the written configuration file
+    :raises configparser.Error: if an existing configuration file can't be parsed
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str  # liblsl's keys are case sensitive
+    config_paths = LSL_API_CONFIG_PATHS
+    if 'LSLAPICFG' in os.environ:
+        if os.path.isfile(os.environ['LSLAPICFG']):
+            config_paths = [os.environ['LSLAPICFG']]
+        else:
+            logger.warning("LSL configuration file %s from LSLAPICFG does not exist, using the default locations",
+                           os.environ['LSLAPICFG'])
+    for path in config_paths:
+        if config.read(path):
+            break
+
+    if not config.has_section('tuning'):
+        config.add_section('tuning')
+    config.set('tuning', 'SendSocketBufferSize', str(send_buffer_kb * 1024))
+
+    with tempfile.NamedTemporaryFile('w', prefix='lsl_api_', suffix='.cfg', delete=False) as config_file:
+        config.write(config_file)
+    atexit.register(remove_file, config_file.name)
+    os.environ['LSLAPICFG'] = config_file.name
+    return config_file.name
+
+
 def signal_stop_fService(signal, frame, fService):
     """
     Signal handler to perform graceful shutdown of application
@@ -63,6 +135,14 @@ if __name__ == "__main__":
                         help="Duration (in seconds) for the stream to run. Infinite if not given")
     parser.add_argument('--heartbeat', type=int, default=60,
                         help="Heartbeat to print every n seconds when streaming data")
+    parser.add_argument('--network-chunk-size', type=non_negative_int, default=0,
+                        help="Number of samples the LSL outlet collects before sending them over the network. "
+                             "0 sends every pushed chunk right away (lowest latency)")
+    parser.add_argument('--max-buffered', type=positive_int, default=FieldLineLSL.MAX_BUFFERED,
+                        help="Maximum number of seconds the LSL outlet buffers for each inlet that can't keep up")
+    parser.add_argument('--send-buffer-kb', type=positive_int, default=None,
+                        help="Size of the socket send buffer of the LSL outlet in kilobytes. "
+                             "liblsl default if not given")
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="Logging verbosity. Repeat up to three times. Defaults to only script info being printed")
 
@@ -71,10 +151,17 @@ if __name__ == "__main__":
     # Configure the logging
     set_verbosity(logging_config, logger, args.verbose)
 
+    if args.send_buffer_kb:
+        try:
+            logger.info("Using LSL configuration file %s", write_lsl_api_config(args.send_buffer_kb))
+        except configparser.Error as e:
+            parser.error(f"--send-buffer-kb: can't read the existing LSL configuration: {e}")
+
     logger.info("Initializing FieldLineLSL")
     print(args.chassis)
     fLSL = FieldLineLSL.FieldLineLSL(ip_list=args.chassis, stream_name=args.stream_name, source_id=args.stream_id, stream_type='MEG',
-                                     log_heartbeat=args.heartbeat, unit_T=FieldLineLSL.Unit_T_Factor.fT)
+                                     log_heartbeat=args.heartbeat, unit_T=FieldLineLSL.Unit_T_Factor.fT,
+                                     network_chunk_size=args.network_chunk_size, max_buffered=args.max_buffered)
 
     logger.info("FieldLineLSL initialized. Calling FieldLineService.open()")
     fLSL.open()  # FieldLineService has to be opened to connect to the chassis
@@ -0,0 +1,52 @@
+"""
+Tests for the parts of FieldLineLSL.py that work without a connected chassis
+Run with python -m unittest. Skipped if the FieldLine API or pylsl are not installed
+"""
+
+import unittest
+
+import numpy as np
+
+try:
+    import FieldLineLSL
+except ImportError:
+    FieldLineLSL = None
+
+
+@unittest.skipIf(FieldLineLSL is None, "FieldLineLSL requires the FieldLine API and pylsl")
+class TestClockDriftEstimator(unittest.TestCase):
+    def test_no_scale_before_enough_measurements(self):
+        estimator = FieldLineLSL.ClockDriftEstimator()
+        for i in range(FieldLineLSL.DRIFT_MIN_MEASUREMENTS - 1):
+            estimator.add(i * 25000, i * 1e-3)
+        self.assertIsNone(estimator.scale)
+
+    def test_scale_is_the_slope(self):
+        tick = 1 / 25e6 * (1 + 20e-6)  # Local seconds per chassis tick with 20 ppm of drift
+        rng = np.random.default_rng(0)
+        estimator = FieldLineLSL.ClockDriftEstimator()
+        for i in range(1000):
+            chassis_delta = i * 25000000  # One measurement per second of data
+            estimator.add(chassis_delta, chassis_delta * tick + 0.3 + rng.normal(scale=1e-4))
+        self.assertAlmostEqual(estimator.scale / tick, 1, delta=1e-6)
+
+
+@unittest.skipIf(FieldLineLSL is None, "FieldLineLSL requires the FieldLine API and pylsl")
+class TestSampleExtractor(unittest.TestCase):
+    def test_extracts_in_channel_order(self):
+        channel_names = ['00:02:50', '00:01:50', '01:01:28']
+        data_frames = {'00:01:50': {'data': 1}, '00:02:50': {'data': 2}, '01:01:28': {'data': 3},
+                       '00:03:50': {'data': 4}}
+        extract = FieldLineLSL.FieldLineLSL._generate_sample_extractor(channel_names)
+        buffer = np.empty(len(channel_names), dtype=np.float32)
+        extract(data_frames, buffer)
+        np.testing.assert_array_equal(buffer, [2, 1, 3])
+
+    def test_missing_channel_raises(self):
+        extract = FieldLineLSL.FieldLineLSL._generate_sample_extractor(['00:01:50'])
+        with self.assertRaises(KeyError):
+            extract({}, np.empty(1, dtype=np.float32))
+
+
+if __name__ == '__main__':
+    unittest.main()
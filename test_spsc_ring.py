@@ -0,0 +1,106 @@
+"""
+Tests for the single-producer/single-consumer ring buffer in spsc_ring.py
+Run with python -m unittest
+"""
+
+import time
+import unittest
+from threading import Thread
+
+from spsc_ring import SPSCRing
+
+
+class TestSPSCRing(unittest.TestCase):
+    def test_get_returns_items_in_order(self):
+        ring = SPSCRing(capacity=8)
+        for item in range(5):
+            ring.put(item)
+        self.assertEqual(len(ring), 5)
+        self.assertEqual([ring.get(timeout=0) for _ in range(5)], list(range(5)))
+        self.assertEqual(len(ring), 0)
+
+    def test_get_timeout_returns_none(self):
+        ring = SPSCRing(capacity=8)
+        t_start = time.monotonic()
+        self.assertIsNone(ring.get(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - t_start, 0.04)
+
+    def test_put_drops_oldest_on_overflow(self):
+        ring = SPSCRing(capacity=3)
+        self.assertEqual([ring.put(item) for item in range(3)], [False, False, False])
+        self.assertTrue(ring.put(3))
+        self.assertTrue(ring.put(4))
+        self.assertEqual(len(ring), ring.capacity)
+        self.assertEqual(ring.drain(10), [2, 3, 4])
+
+    def test_drain_is_bounded_by_max_items(self):
+        ring = SPSCRing(capacity=8)
+        for item in range(5):
+            ring.put(item)
+        self.assertEqual(ring.drain(3), [0, 1, 2])
+        self.assertEqual(ring.drain(3), [3, 4])
+        self.assertEqual(ring.drain(3), [])
+
+    def test_clear(self):
+        ring = SPSCRing(capacity=8)
+        for item in range(5):
+            ring.put(item)
+        ring.clear()
+        self.assertEqual(len(ring), 0)
+        self.assertIsNone(ring.get(timeout=0))
+
+    def test_wakeup_threshold(self):
+        ring = SPSCRing(capacity=16, wakeup_threshold=4)
+        for item in range(3):
+            ring.put(item)
+
+        # Below the threshold, get() waits for the whole timeout but still returns what is there
+        t_start = time.monotonic()
+        self.assertEqual(ring.get(timeout=0.05), 0)
+        self.assertGreaterEqual(time.monotonic() - t_start, 0.04)
+
+        # A waiting get() is woken once the threshold is reached, long before its timeout
+        results = []
+        consumer = Thread(target=lambda: results.append(ring.get(timeout=5)))
+        t_start = time.monotonic()
+        consumer.start()
+        time.sleep(0.05)
+        self.assertTrue(consumer.is_alive())
+        ring.put(3)
+        ring.put(4)
+        consumer.join(timeout=5)
+        self.assertFalse(consumer.is_alive())
+        self.assertLess(time.monotonic() - t_start, 2)
+        self.assertEqual(results, [1])
+
+    def test_wakeup_threshold_is_bounded_by_capacity(self):
+        ring = SPSCRing(capacity=2, wakeup_threshold=10)
+        ring.put(0)
+        ring.put(1)
+        t_start = time.monotonic()
+        self.assertEqual(ring.get(timeout=5), 0)
+        self.assertLess(time.monotonic() - t_start, 2)
+
+    def test_concurrent_handoff_keeps_order(self):
+        n_items = 100000
+        ring = SPSCRing(capacity=n_items, wakeup_threshold=4)
+        received = []
+
+        def consume():
+            while len(received) < n_items:
+                item = ring.get(timeout=5)
+                if item is None:
+                    break
+                received.append(item)
+                received.extend(ring.drain(50))
+
+        consumer = Thread(target=consume)
+        consumer.start()
+        for item in range(n_items):
+            ring.put(item)
+        consumer.join(timeout=30)
+        self.assertEqual(received, list(range(n_items)))
+
+
+if __name__ == '__main__':
+    unittest.main()
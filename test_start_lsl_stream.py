@@ -0,0 +1,93 @@
+"""
+Tests for the command line helpers in start_lsl_stream.py
+Run with python -m unittest. Skipped if the FieldLine API or pylsl are not installed
+"""
+
+import argparse
+import configparser
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import start_lsl_stream
+except ImportError:
+    start_lsl_stream = None
+
+
+@unittest.skipIf(start_lsl_stream is None, "start_lsl_stream requires the FieldLine API and pylsl")
+class TestArgumentTypes(unittest.TestCase):
+    def test_positive_int(self):
+        self.assertEqual(start_lsl_stream.positive_int('5'), 5)
+        for value in ('0', '-1'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                start_lsl_stream.positive_int(value)
+
+    def test_non_negative_int(self):
+        self.assertEqual(start_lsl_stream.non_negative_int('0'), 0)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            start_lsl_stream.non_negative_int('-1')
+
+
+@unittest.skipIf(start_lsl_stream is None, "start_lsl_stream requires the FieldLine API and pylsl")
+class TestWriteLslApiConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        # Keep LSLAPICFG and the atexit handler from leaking out of the tests
+        environ_patch = mock.patch.dict(os.environ)
+        environ_patch.start()
+        self.addCleanup(environ_patch.stop)
+        os.environ.pop('LSLAPICFG', None)
+        atexit_patch = mock.patch.object(start_lsl_stream.atexit, 'register')
+        self.atexit_register = atexit_patch.start()
+        self.addCleanup(atexit_patch.stop)
+
+    def write_config(self, content):
+        path = os.path.join(self.tmp_dir.name, 'lsl_api.cfg')
+        with open(path, 'w') as config_file:
+            config_file.write(content)
+        return path
+
+    def read_written_config(self, send_buffer_kb):
+        path = start_lsl_stream.write_lsl_api_config(send_buffer_kb)
+        self.addCleanup(start_lsl_stream.remove_file, path)
+        self.assertEqual(os.environ['LSLAPICFG'], path)
+        self.atexit_register.assert_called_once_with(start_lsl_stream.remove_file, path)
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        config.read(path)
+        return config
+
+    def test_merges_existing_config(self):
+        os.environ['LSLAPICFG'] = self.write_config(
+            "[lab]\nSessionID = MyLab\n[tuning]\nSendSocketBufferSize = 1\nReceiveSocketBufferSize = 5\n")
+        config = self.read_written_config(256)
+        self.assertEqual(config['lab']['SessionID'], 'MyLab')
+        self.assertEqual(config['tuning']['SendSocketBufferSize'], str(256 * 1024))
+        self.assertEqual(config['tuning']['ReceiveSocketBufferSize'], '5')
+
+    def test_missing_lslapicfg_falls_back_to_default_paths(self):
+        default_path = self.write_config("[lab]\nSessionID = Default\n")
+        os.environ['LSLAPICFG'] = os.path.join(self.tmp_dir.name, 'missing.cfg')
+        with mock.patch.object(start_lsl_stream, 'LSL_API_CONFIG_PATHS', [default_path]), \
+                self.assertLogs(start_lsl_stream.logger, 'WARNING'):
+            config = self.read_written_config(64)
+        self.assertEqual(config['lab']['SessionID'], 'Default')
+        self.assertEqual(config['tuning']['SendSocketBufferSize'], str(64 * 1024))
+
+    def test_unparsable_config_raises(self):
+        os.environ['LSLAPICFG'] = self.write_config("not a section\n")
+        with self.assertRaises(configparser.Error):
+            start_lsl_stream.write_lsl_api_config(64)
+
+    def test_remove_file_ignores_missing_file(self):
+        path = self.write_config("")
+        start_lsl_stream.remove_file(path)
+        self.assertFalse(os.path.exists(path))
+        start_lsl_stream.remove_file(path)
+
+
+if __name__ == '__main__':
+    unittest.main()